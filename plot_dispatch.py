@@ -1,12 +1,201 @@
 # Plotting function for generation dispatch
 # Interactive version (optional)
+from functools import lru_cache
+
 import pandas as pd
 import numpy as np
 
+try:
+    from tsdownsample import LTTBDownsampler
+except ImportError:  # optional: interactive traces are sent at full resolution
+    LTTBDownsampler = None
+
+try:
+    import bottleneck as bn
+except ImportError:  # optional: NumPy's nan-reductions share the same API
+    bn = np
+
+try:
+    import numba
+except ImportError:  # optional: carrier aggregation falls back to a NumPy matmul
+    numba = None
+
+# Maximum points per interactive trace before LTTB downsampling kicks in
+MAX_PLOT_POINTS = 2000
+# Interactive windows with more snapshots than this draw line traces with WebGL
+WEBGL_THRESHOLD = 1000
+# Carriers peaking below this fraction of the largest peak are shown as 'Other'
+OTHER_THRESHOLD = 0.01
+OTHER_COLOR = '#cccccc'
+IMPORTS_COLOR = '#7f7f7f'
+
+
+if numba is not None:
+    @numba.njit(cache=True, fastmath=True)
+    def _agg_by_carrier(p, codes, mask, n_carriers):
+        """Sum the masked columns of `p` (T x G) into `n_carriers` groups by `codes`."""
+        T, G = p.shape
+        out = np.zeros((T, n_carriers))
+        for t in range(T):
+            for j in range(G):
+                if mask[j]:
+                    out[t, codes[j]] += p[t, j]
+        return out
+
+
+def _isin(col, values):
+    """
+    Boolean mask of `col` in `values` as a NumPy array. Categorical columns
+    (see `streamlit_app.load_network`) are compared on their integer codes.
+    """
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        cats = col.cat.categories
+        codes = np.array([cats.get_loc(v) for v in values if v in cats], dtype=np.int32)
+        return np.isin(col.cat.codes.to_numpy(), codes)
+    return col.isin(values).to_numpy()
+
+
+@lru_cache(maxsize=128)
+def _parse_window(time, days=None):
+    """Start/end timestamps for a `time` string ("2024", "2024-07", "2024-07-15") and `days`."""
+    parts = time.split("-")
+    if len(parts) == 1:
+        start = pd.to_datetime(f"{parts[0]}-01-01")
+    elif len(parts) == 2:
+        start = pd.to_datetime(f"{parts[0]}-{parts[1]}-01")
+    else:
+        start = pd.to_datetime(time)
+
+    if days is not None:
+        end = start + pd.Timedelta(days=days) - pd.Timedelta(hours=1)
+    elif len(parts) == 1:
+        end = pd.to_datetime(f"{parts[0]}-12-31 23:00")
+    elif len(parts) == 2:
+        end = start + pd.offsets.MonthEnd(0) + pd.Timedelta(hours=23)
+    else:
+        end = start + pd.Timedelta(hours=23)
+    return start, end
+
+
+def region_masks(n, regions=None):
+    """
+    Boolean NumPy masks selecting the parts of `n` that belong to `regions`.
+
+    Parameters
+    ----------
+    n : pypsa.Network
+        The PyPSA network to mask.
+    regions : list of str, optional
+        Region bus names to filter by. If None, the entire network is included.
+
+    Returns
+    -------
+    dict
+        'gen', 'sto', 'store' and 'load' flag units at region buses (aligned
+        with the static component tables); 'ac_in'/'ac_out' and 'dc_in'/'dc_out'
+        flag lines and links entering or leaving the region.
+    """
+    if regions is not None:
+        region_buses = set(regions)
+        gen   = _isin(n.generators.bus, region_buses)
+        sto   = _isin(n.storage_units.bus, region_buses)
+        store = _isin(n.stores.bus, region_buses)
+        load  = _isin(n.loads.bus, region_buses)
+    else:
+        region_buses = set(n.buses.index)
+        gen   = np.ones(len(n.generators), dtype=bool)
+        sto   = np.ones(len(n.storage_units), dtype=bool)
+        store = np.ones(len(n.stores), dtype=bool)
+        load  = np.ones(len(n.loads), dtype=bool)
+    ac0, ac1 = _isin(n.lines.bus0, region_buses), _isin(n.lines.bus1, region_buses)
+    dc0, dc1 = _isin(n.links.bus0, region_buses), _isin(n.links.bus1, region_buses)
+    return {
+        'gen': gen, 'sto': sto, 'store': store, 'load': load,
+        'ac_in': ac1 & ~ac0, 'ac_out': ac0 & ~ac1,
+        'dc_in': dc1 & ~dc0, 'dc_out': dc0 & ~dc1,
+    }
+
+
+def _lttb_indices(index, y, n_out=MAX_PLOT_POINTS):
+    """
+    Positions of `index` kept by Largest-Triangle-Three-Buckets downsampling
+    of `y`, or None when no downsampling is needed (or tsdownsample is missing).
+    """
+    if LTTBDownsampler is None or len(index) <= n_out:
+        return None
+    x = index.to_numpy().astype('datetime64[ns]').astype(np.int64)
+    return LTTBDownsampler().downsample(x, np.ascontiguousarray(y, dtype=np.float64),
+                                        n_out=n_out).astype(np.intp)
+
+
+def _net_import(p0, p1, branches, into, out_of):
+    """
+    Net flow into a region (MW) over `branches` (lines or links).
+    Branches flagged `into` contribute p0, those flagged `out_of` contribute p1;
+    both masks become 0/1 weight vectors so each side is a single matvec.
+    """
+    w_in  = pd.Series(into.astype(float), index=branches.index)
+    w_out = pd.Series(out_of.astype(float), index=branches.index)
+    flow = (p0.to_numpy() @ w_in.reindex(p0.columns, fill_value=0.0).to_numpy()
+            + p1.to_numpy() @ w_out.reindex(p1.columns, fill_value=0.0).to_numpy())
+    return pd.Series(flow, index=p0.index)
+
+
+def aggregate_by_carrier(n, regions=None, start=None, end=None, masks=None):
+    """
+    Aggregate generator, storage unit and store dispatch by carrier.
+
+    Parameters
+    ----------
+    n : pypsa.Network
+        The PyPSA network to aggregate.
+    regions : list of str, optional
+        Region bus names to filter by. If None, the entire network is included.
+    start, end : pandas.Timestamp, optional
+        Snapshot window to aggregate. Defaults to the full horizon.
+    masks : dict, optional
+        Precomputed output of `region_masks(n, regions)`.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Dispatch in GW, indexed by snapshot with one column per carrier.
+    """
+    if masks is None:
+        masks = region_masks(n, regions)
+
+    def _agg(df_t, df_stat, mask):
+        window = df_t.loc[start:end]
+        sel = window.columns.isin(df_stat.index[mask])
+        carrier = df_stat['carrier'].reindex(window.columns).to_numpy(dtype=object)
+        codes = np.full(len(carrier), -1, dtype=np.int64)
+        sel_codes, carriers = pd.factorize(carrier[sel], sort=True)
+        codes[sel] = sel_codes
+        if numba is not None:
+            out = _agg_by_carrier(window.to_numpy(), codes, sel, len(carriers))
+        else:
+            # column-wise groupby via a carrier indicator matrix (no transposes)
+            onehot = np.zeros((len(sel_codes), len(carriers)))
+            onehot[np.arange(len(sel_codes)), sel_codes] = 1.0
+            out = window.to_numpy()[:, sel] @ onehot
+        return pd.DataFrame(out, index=window.index, columns=carriers).div(1e3)
+
+    p_by_carrier = _agg(n.generators_t.p, n.generators, masks['gen'])
+    if not n.storage_units.empty:
+        p_by_carrier = pd.concat([p_by_carrier,
+                                  _agg(n.storage_units_t.p, n.storage_units, masks['sto'])],
+                                 axis=1)
+    if not n.stores.empty:
+        p_by_carrier = pd.concat([p_by_carrier,
+                                  _agg(n.stores_t.p, n.stores, masks['store'])],
+                                 axis=1)
+    return p_by_carrier
+
 
 def plot_dispatch(n, time="2024", days=None, regions=None,
                    show_imports=True, show_curtailment=True,
-                   scenario_name=None, scenario_objective=None, interactive=False):
+                   scenario_name=None, scenario_objective=None, interactive=False,
+                   p_by_carrier=None, masks=None, webgl_threshold=WEBGL_THRESHOLD):
      """
      Plot a generation dispatch stack by carrier for a PyPSA network, with optional
      net imports/exports and a region‑filtered curtailment overlay.
@@ -31,6 +220,16 @@ def plot_dispatch(n, time="2024", days=None, regions=None,
          Objective description to display next to the legend.
      interactive : bool, default False
          Whether to create an interactive plot using Plotly instead of matplotlib.
+     p_by_carrier : pandas.DataFrame, optional
+         Precomputed output of `aggregate_by_carrier(n, regions)`. When given,
+         the carrier aggregation step is skipped and the frame is only sliced.
+     masks : dict, optional
+         Precomputed output of `region_masks(n, regions)`, reused across calls
+         that only change the time window or display options.
+     webgl_threshold : int, default WEBGL_THRESHOLD
+         Interactive demand/curtailment lines of windows with more snapshots
+         than this (counted before LTTB downsampling) are drawn with WebGL
+         (`go.Scattergl`). Stacked areas always use SVG.
 
      Notes
      -----
@@ -49,95 +248,60 @@ def plot_dispatch(n, time="2024", days=None, regions=None,
          import matplotlib.pyplot as plt
      
      # 1) REGION MASKS
-     if regions is not None:
-         gen_mask   = n.generators.bus.isin(regions)
-         sto_mask   = n.storage_units.bus.isin(regions) if not n.storage_units.empty else []
-         store_mask = n.stores.bus.isin(regions) if not n.stores.empty else []
-         region_buses = set(regions)
-         
-     else:
-        gen_mask = pd.Series(True, index=n.generators.index)
-        sto_mask = pd.Series(True, index=n.storage_units.index) if not n.storage_units.empty else pd.Series(dtype=bool)
-        store_mask = pd.Series(True, index=n.stores.index) if not n.stores.empty else pd.Series(dtype=bool)
-        region_buses = set(n.buses.index)
+     if masks is None:
+         masks = region_masks(n, regions)
 
-     # 2) AGGREGATE BY CARRIER (GW)
-     def _agg(df_t, df_stat, mask):
-         return (
-             df_t.loc[:, mask]
-                 .T
-                 .groupby(df_stat.loc[mask, 'carrier'])
-                 .sum()
-                 .T
-                 .div(1e3)
-         )
+     # 2) TIME WINDOW
+     start, end = _parse_window(time, days)
 
-     p_by_carrier = _agg(n.generators_t.p, n.generators, gen_mask)
-     if not n.storage_units.empty:
-         p_by_carrier = pd.concat([p_by_carrier,
-                                   _agg(n.storage_units_t.p, n.storage_units, sto_mask)],
-                                  axis=1)
-     if not n.stores.empty:
-         p_by_carrier = pd.concat([p_by_carrier,
-                                   _agg(n.stores_t.p, n.stores, store_mask)],
-                                  axis=1)
-
-     # 3) TIME WINDOW
-     parts = time.split("-")
-     if len(parts) == 1:
-         start = pd.to_datetime(f"{parts[0]}-01-01")
-     elif len(parts) == 2:
-         start = pd.to_datetime(f"{parts[0]}-{parts[1]}-01")
-     else:
-         start = pd.to_datetime(time)
-
-     if days is not None:
-         end = start + pd.Timedelta(days=days) - pd.Timedelta(hours=1)
-     elif len(parts) == 1:
-         end = pd.to_datetime(f"{parts[0]}-12-31 23:00")
-     elif len(parts) == 2:
-         end = start + pd.offsets.MonthEnd(0) + pd.Timedelta(hours=23)
-     else:
-         end = start + pd.Timedelta(hours=23)
+     # 3) AGGREGATE BY CARRIER (GW)
+     if p_by_carrier is None:
+         p_by_carrier = aggregate_by_carrier(n, regions, start, end, masks=masks)
 
-     p_slice = p_by_carrier.loc[start:end].copy()
+     # slice is a view; drop() below returns the new frame, so no explicit copy
+     p_slice = p_by_carrier.loc[start:end]
+     # float32 is ample for GW values plotted to 3 decimals and halves the bytes moved
+     p_slice = p_slice.astype(np.float32, copy=False)
      # drop carriers with zero activity
-     zero = p_slice.columns[p_slice.abs().sum() == 0]
-     p_slice.drop(columns=zero, inplace=True)
+     zero = p_slice.columns[p_slice.abs().sum(axis=0).to_numpy() == 0]
+     p_slice = p_slice.drop(columns=zero)
 
      # 4) IMPORTS/EXPORTS
      if show_imports:
-         ac = ( n.lines_t.p0.loc[start:end, n.lines.bus1.isin(region_buses) & ~n.lines.bus0.isin(region_buses)].sum(axis=1)
-              + n.lines_t.p1.loc[start:end, n.lines.bus0.isin(region_buses) & ~n.lines.bus1.isin(region_buses)].sum(axis=1) )
-         dc = ( n.links_t.p0.loc[start:end, n.links.bus1.isin(region_buses) & ~n.links.bus0.isin(region_buses)].sum(axis=1)
-              + n.links_t.p1.loc[start:end, n.links.bus0.isin(region_buses) & ~n.links.bus1.isin(region_buses)].sum(axis=1) )
-         p_slice['Imports/Exports'] = (ac + dc).div(1e3)
-         if 'Imports/Exports' not in n.carriers.index:
-             n.carriers.loc['Imports/Exports','color']='#7f7f7f'
+         ac = _net_import(n.lines_t.p0.loc[start:end], n.lines_t.p1.loc[start:end],
+                          n.lines, masks['ac_in'], masks['ac_out'])
+         dc = _net_import(n.links_t.p0.loc[start:end], n.links_t.p1.loc[start:end],
+                          n.links, masks['dc_in'], masks['dc_out'])
+         p_slice['Imports/Exports'] = (ac + dc).div(1e3).astype(np.float32)
 
      # 5) LOAD SERIES
      if regions:
-         load_cols = [c for c in n.loads[n.loads.bus.isin(regions)].index if c in n.loads_t.p_set]
+         load_cols = [c for c in n.loads.index[masks['load']] if c in n.loads_t.p_set]
          load_series = n.loads_t.p_set[load_cols].sum(axis=1)
      else:
          load_series = n.loads_t.p_set.sum(axis=1)
-     load_series = load_series.loc[start:end].div(1e3)
+     load_series = load_series.loc[start:end].div(1e3).astype(np.float32)
 
      # 6) VRE CURTAILMENT (GW) if requested
      if show_curtailment:
          vre = ['Solar','Wind', 'Rooftop Solar']
-         mask_vre = gen_mask & n.generators.carrier.isin(vre)
-         avail = (n.generators_t.p_max_pu.loc[start:end, mask_vre]
-                  .multiply(n.generators.loc[mask_vre,'p_nom'], axis=1))
-         disp  = n.generators_t.p.loc[start:end, mask_vre]
-         curtail = (avail.sub(disp, fill_value=0)
-                        .clip(lower=0)
-                        .sum(axis=1)
-                        .div(1e3))
+         vre_gens = n.generators.index[masks['gen'] & _isin(n.generators.carrier, vre)]
+         p_nom = n.generators.loc[vre_gens, 'p_nom'].to_numpy()
+         # generators without a time-varying p_max_pu count as zero availability
+         avail_arr = (n.generators_t.p_max_pu.loc[start:end]
+                      .reindex(columns=vre_gens, fill_value=0.0)
+                      .to_numpy() * p_nom)
+         disp = n.generators_t.p.loc[start:end, vre_gens]
+         curtail_arr = np.maximum(0.0, avail_arr - disp.to_numpy()).sum(axis=1) / 1e3
+         curtail = pd.Series(curtail_arr, index=disp.index, dtype=np.float32)
      else:
          curtail = None
 
      # 7) PLOT
+     color_map = n.carriers['color'].to_dict()
+     color_map.setdefault('Other', OTHER_COLOR)
+     # set here rather than on n.carriers so cached networks are never mutated
+     color_map.setdefault('Imports/Exports', IMPORTS_COLOR)
      title_tail = f" for {', '.join(regions)}" if regions else ''
      plot_title = f"Dispatch by Carrier: {start.date()} to {end.date()}{title_tail}"
      
@@ -151,54 +315,84 @@ def plot_dispatch(n, time="2024", days=None, regions=None,
             yaxis=dict(gridcolor='#DDDDDD')        # Plot area background
          ) 
 
-         # Prepare data for stacked area plot
-         positive_data = p_slice.where(p_slice > 0).fillna(0)
-         negative_data = p_slice.where(p_slice < 0).fillna(0)
+         # Fold minor carriers into a single 'Other' trace to keep the trace count down
+         peak = p_slice.abs().max()
+         small = peak.index[(peak < OTHER_THRESHOLD * peak.max())
+                            & (peak.index != 'Imports/Exports')]
+         if len(small) > 1:
+             other = p_slice[small].sum(axis=1)
+             p_slice = p_slice.drop(columns=small)
+             p_slice['Other'] = p_slice['Other'] + other if 'Other' in p_slice else other
+
+         # Prepare data for stacked area plot (single split of the values)
+         cols_list = p_slice.columns.tolist()
+         x_index = p_slice.index
+         n_snapshots = len(x_index)  # window length before any downsampling
+         arr = p_slice.to_numpy()
+         demand_x, demand_y = load_series.index, load_series.to_numpy()
+         curtail_x = curtail.index if curtail is not None else None
+         curtail_y = curtail.to_numpy() if curtail is not None else None
+
+         # Downsample long windows to one shared set of snapshots so the
+         # stacked areas and lines stay aligned under unified hover
+         keep = _lttb_indices(x_index, np.abs(arr).sum(axis=1))
+         if keep is not None:
+             arr, x_index = arr[keep], x_index[keep]
+             demand_x, demand_y = demand_x[keep], demand_y[keep]
+             if curtail is not None:
+                 curtail_x, curtail_y = curtail_x[keep], curtail_y[keep]
+
+         pos_arr = np.clip(arr, 0, None)
+         neg_arr = np.clip(arr, None, 0)
+         traces = []
          
          # Add positive generation as stacked area
-         for i, col in enumerate(positive_data.columns):
-             if positive_data[col].sum() > 0:
-                 color = n.carriers.loc[col, 'color']
-                 # Only add points where value > 0.001
-                 mask = positive_data[col].abs() > 0.001
-                 if mask.any():
-                     fig.add_trace(go.Scatter(
-                         x=positive_data.index[mask],
-                         y=positive_data[col][mask],
-                         mode='lines',
-                         fill='tonexty' if i > 0 else 'tozeroy',
-                         line=dict(width=0, color=color),
-                         fillcolor=color,
-                         name=col,
-                         stackgroup='positive',
-                         hovertemplate='<b>%{fullData.name}</b><br>Power: %{y:.3f} GW<extra></extra>',
-                         showlegend=True
-                     ))
+         for j, col in enumerate(cols_list):
+             y = pos_arr[:, j]
+             # Only add points where value > 0.001
+             mask = y > 0.001
+             if mask.any():
+                 color = color_map[col]
+                 traces.append(go.Scatter(
+                     x=x_index[mask],
+                     y=y[mask],
+                     mode='lines',
+                     fill='tonexty' if j > 0 else 'tozeroy',
+                     line=dict(width=0, color=color),
+                     fillcolor=color,
+                     name=col,
+                     stackgroup='positive',
+                     hovertemplate='<b>%{fullData.name}</b><br>Power: %{y:.3f} GW<extra></extra>',
+                     showlegend=True
+                 ))
          
          # Add negative generation (storage charging, exports)
-         for col in negative_data.columns:
-             if negative_data[col].sum() < 0:
-                 color = n.carriers.loc[col, 'color']
-                 # Only add points where value < -0.001
-                 mask = negative_data[col].abs() > 0.001
-                 if mask.any():
-                     fig.add_trace(go.Scatter(
-                         x=negative_data.index[mask],
-                         y=negative_data[col][mask],
-                         mode='lines',
-                         fill='tonexty',
-                         line=dict(width=0, color=color),
-                         fillcolor=color,
-                         name=col,
-                         stackgroup='negative',
-                         hovertemplate='<b>%{fullData.name}</b><br>Power: %{y:.2f} GW<extra></extra>',
-                         showlegend=True
-                     ))
+         for j, col in enumerate(cols_list):
+             y = neg_arr[:, j]
+             # Only add points where value < -0.001
+             mask = y < -0.001
+             if mask.any():
+                 color = color_map[col]
+                 traces.append(go.Scatter(
+                     x=x_index[mask],
+                     y=y[mask],
+                     mode='lines',
+                     fill='tonexty',
+                     line=dict(width=0, color=color),
+                     fillcolor=color,
+                     name=col,
+                     stackgroup='negative',
+                     hovertemplate='<b>%{fullData.name}</b><br>Power: %{y:.2f} GW<extra></extra>',
+                     showlegend=True
+                 ))
          
+         # Long line traces are drawn with WebGL (stacked areas need SVG for stackgroup)
+         line_trace = go.Scattergl if n_snapshots > webgl_threshold else go.Scatter
+
          # Add demand line (always show)
-         fig.add_trace(go.Scatter(
-             x=load_series.index,
-             y=load_series,
+         traces.append(line_trace(
+             x=demand_x,
+             y=demand_y,
              mode='lines',
              line=dict(color='green', width=2),
              name='Demand',
@@ -208,9 +402,9 @@ def plot_dispatch(n, time="2024", days=None, regions=None,
          
          # Add curtailment line if requested
          if show_curtailment and curtail is not None:
-             fig.add_trace(go.Scatter(
-                 x=curtail.index,
-                 y=curtail,
+             traces.append(line_trace(
+                 x=curtail_x,
+                 y=curtail_y,
                  mode='lines',
                  line=dict(color='black', width=2, dash='dash'),
                  name='Curtailment',
@@ -218,6 +412,9 @@ def plot_dispatch(n, time="2024", days=None, regions=None,
                  showlegend=True
                  ))
          
+         # Register all traces in one call
+         fig.add_traces(traces)
+         
          # Update layout
          fig.update_layout(
              title=plot_title,
@@ -264,28 +461,30 @@ def plot_dispatch(n, time="2024", days=None, regions=None,
      else:
          # MATPLOTLIB STATIC PLOT 
          fig, ax = plt.subplots(figsize=(8.4, 6.5)) #12,6.5
-         cols = p_slice.columns.map(lambda c: n.carriers.loc[c,'color'])
+         cols = p_slice.columns.map(color_map.get)
          p_slice.where(p_slice>0).plot.area(ax=ax,linewidth=0,color=cols)
          neg = p_slice.where(p_slice<0).dropna(how='all',axis=1)
          if not neg.empty:
-             neg_cols=[n.carriers.loc[c,'color'] for c in neg.columns]
+             neg_cols=[color_map[c] for c in neg.columns]
              neg.plot.area(ax=ax,linewidth=0,color=neg_cols)
          load_series.plot(ax=ax,color='g',linewidth=1.5,label='Demand')
          if show_curtailment and curtail is not None:
              curtail.plot(ax=ax,color='k',linestyle='--',linewidth=1.2,label='Curtailment')
 
          # limits & legend
-         up = max(p_slice.where(p_slice>0).sum(axis=1).max(),
+         arr = p_slice.to_numpy()
+         pos_sum = bn.nansum(np.where(arr>0, arr, 0), axis=1)
+         neg_sum = bn.nansum(np.where(arr<0, arr, 0), axis=1)
+         up = max(bn.nanmax(pos_sum),
                   load_series.max(),
                   curtail.max() if curtail is not None else 0)
-         dn = min(p_slice.where(p_slice<0).sum(axis=1).min(), load_series.min())
+         dn = min(bn.nanmin(neg_sum), load_series.min())
          ax.set_ylim(dn if not np.isclose(up,dn) else dn-0.1, up)
         #  fig.patch.set_facecolor('#F0FFFF') 
          ax.set_facecolor('#F0FFFF')
          h,l = ax.get_legend_handles_labels()
-         seen={} ; fh,fl=[],[]
-         for hh,ll in zip(h,l):
-             if ll not in seen: fh.append(hh);fl.append(ll);seen[ll]=True
+         fl = list(dict.fromkeys(l))
+         fh = [h[l.index(ll)] for ll in fl]
          ax.legend(fh,fl,loc=(1.02,0.67), fontsize=9)
 
          # scenario text
@@ -1,8 +1,17 @@
+import importlib.util
+import json
+import os
+import threading
+import weakref
 import streamlit as st
 import pandas as pd
 from pathlib import Path
-import pypsa
-from plot_dispatch import plot_dispatch
+
+# pypsa, xarray and plot_dispatch (numba) are imported where they are first
+# needed, so the page shell renders before the scientific stack is loaded
+
+# h5netcdf reads the HDF5-based scenario files through h5py, without netCDF4
+NETCDF_ENGINE = "h5netcdf" if importlib.util.find_spec("h5netcdf") else None
 
 # Page config
 st.set_page_config(
@@ -12,53 +21,98 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-st.markdown(
-    """
-    <style>
-    section[data-testid="stSidebar"] p {
-        font-size: 12px !important;
-    }
-    </style>
-    """,
-    unsafe_allow_html=True
-)
+@st.cache_resource
+def _inject_css():
+    """Inject the sidebar CSS once; Streamlit replays the cached element on later reruns"""
+    st.markdown(
+        """
+        <style>
+        section[data-testid="stSidebar"] p {
+            font-size: 12px !important;
+        }
+        </style>
+        """,
+        unsafe_allow_html=True
+    )
+    return True
+
+_inject_css()
 
 # Cache network loading and scenario data
 @st.cache_data
+def _scan_dir(dir_path: str, mtime: float):
+    """Sorted (name, path) pairs for the files in a directory (keyed on its mtime)"""
+    return sorted((e.name, e.path) for e in os.scandir(dir_path) if e.is_file())
+
+def _dir_entries(dir_path: str):
+    """Files in a directory, rescanned only when the directory changes"""
+    if not os.path.isdir(dir_path):
+        return []
+    return _scan_dir(dir_path, os.stat(dir_path).st_mtime)
+
 def get_scenarios(resolution="30mins"):
     """Get available scenarios for specified resolution"""
-    scen_dir = Path(f"results/scenarios/{resolution}")
-    if scen_dir.exists():
-        return {p.stem: str(p) for p in sorted(scen_dir.glob("*.nc"))}
-    return {}
+    return {Path(name).stem: path
+            for name, path in _dir_entries(f"results/scenarios/{resolution}")
+            if name.endswith(".nc")}
+
+def _write_parquet(df, path: Path):
+    """Write df to path atomically, so readers never see a partially written file"""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        df.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+    except OSError:
+        tmp.unlink(missing_ok=True)  # read-only results directory: the in-memory cache still applies
+
+def _read_parquet(path: Path, columns: list):
+    """Read the given columns of a parquet cache file, or None if it is unreadable or outdated"""
+    try:
+        return pd.read_parquet(path, columns=columns)
+    except Exception:
+        return None
 
 @st.cache_data
+def _read_scenario_objectives(csv_path: str, mtime: float, parquet_path: str):
+    """Scenario -> objective map, via a parquet copy of the summary CSV when it is current"""
+    parquet_file = Path(parquet_path)
+    source = Path(csv_path).name
+    # the parquet records the CSV it was built from, so a different or rewritten
+    # summary is re-read regardless of how the file mtimes compare
+    df = _read_parquet(parquet_file, ['scenario', 'objective', 'source', 'source_mtime'])
+    if df is not None and len(df) and (df.source == source).all() and (df.source_mtime == mtime).all():
+        return dict(zip(df.scenario, df.objective))
+
+    # the pyarrow engine rejects positional usecols, so take the first two columns after reading
+    df = pd.read_csv(csv_path, engine="pyarrow", dtype="string").iloc[:, :2].dropna()
+    df = pd.DataFrame({
+        'scenario': df.iloc[:, 0],
+        'objective': df.iloc[:, 1].str.replace("\\n", "\n", regex=False),
+        'source': source,
+        'source_mtime': mtime,
+    })
+    _write_parquet(df, parquet_file)
+    return dict(zip(df.scenario, df.objective))
+
 def load_scenario_objectives(resolution="30mins"):
     """Load scenario objectives from CSV for specified resolution"""
     try:
-        results_dir = Path(f"results/scenarios/{resolution}")
-        csv_files = list(results_dir.glob("scenarios_summary_*.csv"))
+        csv_files = [Path(path) for name, path in _dir_entries(f"results/scenarios/{resolution}")
+                     if name.startswith("scenarios_summary_") and name.endswith(".csv")]
         
         if not csv_files:
             st.warning(f"No scenarios_summary_*.csv file found in results/scenarios/{resolution}/")
             return {}
         
-        # Use the most recent CSV file
-        csv_file = sorted(csv_files)[-1]
-        
-        # Read only the first two columns (Scenario and Objective)
-        df_results = pd.read_csv(csv_file, usecols=[0, 1])
+        # Use the most recent CSV file (entries are already sorted by name)
+        csv_file = csv_files[-1]
         
-        # Create a dictionary mapping scenario name to objective
-        objectives = {}
-        
-        for _, row in df_results.iterrows():
-            scenario_name = str(row.iloc[0])
-            objective = str(row.iloc[1])
-            
-            if pd.notna(scenario_name) and pd.notna(objective):
-                objective = objective.replace("\\n", "\n")
-                objectives[scenario_name] = objective
+        # Map scenario name to objective (re-read only when the file changes)
+        objectives = _read_scenario_objectives(
+            str(csv_file),
+            csv_file.stat().st_mtime,
+            f"results/scenarios/{resolution}/objectives.parquet",
+        )
         
         st.sidebar.success(f"✅ Loaded {len(objectives)} objectives from {csv_file.name}")
         return objectives
@@ -67,25 +121,179 @@ def load_scenario_objectives(resolution="30mins"):
         st.sidebar.error(f"Error loading scenario objectives: {e}")
         return {}
 
-@st.cache_data
+# libhdf5 (as bundled with netCDF4) is not thread-safe, and Streamlit runs each
+# session on its own thread. The script module is re-executed on every rerun,
+# so the lock lives in the resource cache rather than in a module global.
+@st.cache_resource
+def _netcdf_lock():
+    """Process-wide lock serialising all NetCDF reads"""
+    return threading.Lock()
+
+# Plots up to this many days read only their snapshot window from the NetCDF file
+# while the full network is not yet loaded
+WINDOW_LOAD_MAX_DAYS = 31
+# Plot windows with more snapshots than this draw their line traces with WebGL
+WEBGL_MIN_POINTS = 2000
+
+def _open_netcdf(path_str: str):
+    """Open a scenario file lazily with xarray, through h5netcdf when it is installed"""
+    import xarray as xr
+    return xr.open_dataset(path_str, engine=NETCDF_ENGINE)
+
+def _snapshot_values(ds):
+    """Snapshot timestamps of an opened scenario file as a NumPy array"""
+    # Recent PyPSA versions store the snapshot timestamps in `snapshots_snapshot`
+    snaps = ds['snapshots_snapshot'] if 'snapshots_snapshot' in ds else ds['snapshots']
+    return snaps.values
+
+def _categorize(n):
+    """Categorical bus/carrier columns let plot_dispatch build masks from int codes"""
+    for df, cols in [(n.generators, ['bus', 'carrier']),
+                     (n.lines, ['bus0', 'bus1']),
+                     (n.links, ['bus0', 'bus1']),
+                     (n.loads, ['bus'])]:
+        for col in cols:
+            df[col] = df[col].astype('category')
+    return n
+
+@st.cache_resource
+def _resident_networks():
+    """Weak references to the networks currently held in load_network's cache"""
+    return weakref.WeakValueDictionary()
+
+@st.cache_resource(max_entries=4, ttl=3600)
 def load_network(path_str: str):
-    """Load PyPSA network with caching"""
-    return pypsa.Network(path_str)
+    """Load PyPSA network with caching (shared, not copied, across reruns and sessions)"""
+    import pypsa
+    with _netcdf_lock(), _open_netcdf(path_str) as ds:
+        n = pypsa.Network()
+        n.import_from_netcdf(ds)
+    _resident_networks()[path_str] = n
+    return _categorize(n)
+
+@st.cache_resource(max_entries=8, ttl=3600)
+def load_network_window(path_str: str, start: str, end: str):
+    """Load a PyPSA network restricted to the snapshots between start and end (inclusive)"""
+    import pypsa
+    with _netcdf_lock(), _open_netcdf(path_str) as ds:
+        window = pd.DatetimeIndex(_snapshot_values(ds)).slice_indexer(pd.Timestamp(start), pd.Timestamp(end))
+        n = pypsa.Network()
+        n.import_from_netcdf(ds.isel(snapshots=window))
+    return _categorize(n)
 
 @st.cache_data
+def _read_network_info(scenario_path: str, mtime: float, size: int):
+    """Read bus names and snapshot range straight from the NetCDF file (keyed on mtime/size)"""
+    with _netcdf_lock(), _open_netcdf(scenario_path) as ds:
+        # Snapshots are stored in order, so the range is just the first and last entries
+        first, last = pd.DatetimeIndex(_snapshot_values(ds)[[0, -1]])
+        return {
+            'regions': ds['buses_i'].values.tolist(),
+            'start_date': first.date(),
+            'end_date': last.date()
+        }
+
 def get_network_info(scenario_path: str):
     """Get basic network info without loading full network"""
     try:
-        n = load_network(scenario_path)
-        return {
-            'regions': list(n.buses.index),
-            'start_date': n.snapshots.min().date(),
-            'end_date': n.snapshots.max().date()
-        }
+        stat = Path(scenario_path).stat()
+        return _read_network_info(scenario_path, stat.st_mtime, stat.st_size)
     except Exception as e:
         st.error(f"Error loading network info: {e}")
         return None
 
+def _try_read_network_info(scenario_path: str, mtime: float, size: int):
+    """_read_network_info, or None when the file cannot be read (no st.* calls, safe in cached code)"""
+    try:
+        return _read_network_info(scenario_path, mtime, size)
+    except Exception:
+        return None
+
+@st.cache_data
+def _build_scenario_index(index_path: str, stamps: tuple):
+    """Network info for each (name, path, mtime, size) in stamps, reusing matching rows of a parquet sidecar"""
+    index_file = Path(index_path)
+    cached = {}
+    df = _read_parquet(index_file, ['scenario', 'path', 'mtime', 'size', 'regions_json', 'start', 'end'])
+    if df is not None:
+        cached = {
+            (row.scenario, row.path, row.mtime, row.size): {
+                'regions': json.loads(row.regions_json),
+                'start_date': row.start.date(),
+                'end_date': row.end.date()
+            }
+            for row in df.itertuples()
+        }
+
+    # only scenarios whose file is new or changed since the sidecar was written are re-read;
+    # unreadable ones are left out and report their error when selected
+    rows = {stamp: cached.get(stamp) or _try_read_network_info(*stamp[1:]) for stamp in stamps}
+    rows = {stamp: info for stamp, info in rows.items() if info}
+    if rows.keys() != cached.keys():
+        _write_parquet(pd.DataFrame({
+            'scenario': [name for name, _, _, _ in rows],
+            'path': [path for _, path, _, _ in rows],
+            'mtime': [mtime for _, _, mtime, _ in rows],
+            'size': [size for _, _, _, size in rows],
+            'regions_json': [json.dumps(info['regions']) for info in rows.values()],
+            'start': pd.to_datetime([info['start_date'] for info in rows.values()]),
+            'end': pd.to_datetime([info['end_date'] for info in rows.values()]),
+        }), index_file)
+    return {name: info for (name, _, _, _), info in rows.items()}
+
+def get_scenario_index(resolution, scenarios):
+    """Get network info for all scenarios of a resolution from results/scenarios/<res>/index.parquet"""
+    index_path = Path(f"results/scenarios/{resolution}/index.parquet")
+    stamps = []
+    for name, path in scenarios.items():
+        stat = Path(path).stat()
+        stamps.append((name, path, stat.st_mtime, stat.st_size))
+    return _build_scenario_index(str(index_path), tuple(stamps))
+
+@st.cache_data(max_entries=16, ttl=3600)
+def topology_masks(scenario_path: str, regions_key: tuple):
+    """Region masks for units and AC/DC branches of a scenario with caching"""
+    from plot_dispatch import region_masks
+    n = load_network(scenario_path)
+    return region_masks(n, list(regions_key))
+
+@st.cache_data(max_entries=8, ttl=3600)
+def build_p_by_carrier(scenario_path: str, regions_key: tuple):
+    """Aggregate dispatch by carrier (GW) for a scenario and region selection with caching"""
+    from plot_dispatch import aggregate_by_carrier
+    n = load_network(scenario_path)
+    return aggregate_by_carrier(n, masks=topology_masks(scenario_path, regions_key))
+
+@st.cache_data(show_spinner=False, max_entries=32, ttl=3600)
+def build_fig(scenario_path, start_date_str, days, regions_key, show_imports, show_curtailment, scenario_name, scenario_objective):
+    """Build the interactive dispatch figure with caching"""
+    from plot_dispatch import plot_dispatch
+    if days <= WINDOW_LOAD_MAX_DAYS and scenario_path not in _resident_networks():
+        # Short windows on a cold cache: read only the needed snapshots and
+        # aggregate them directly; once the full network is resident, replot from it
+        end_date_str = (pd.Timestamp(start_date_str) + pd.Timedelta(days=days)).strftime("%Y-%m-%d")
+        n = load_network_window(scenario_path, start_date_str, end_date_str)
+        masks = p_by_carrier = None
+    else:
+        n = load_network(scenario_path)
+        masks = topology_masks(scenario_path, regions_key)
+        p_by_carrier = build_p_by_carrier(scenario_path, regions_key)
+    
+    return plot_dispatch(
+        n,
+        time=start_date_str,
+        days=days,
+        regions=list(regions_key),
+        show_imports=show_imports,
+        show_curtailment=show_curtailment,
+        scenario_name=scenario_name,
+        scenario_objective=scenario_objective,
+        interactive=True,
+        p_by_carrier=p_by_carrier,
+        masks=masks,
+        webgl_threshold=WEBGL_MIN_POINTS,
+    )
+
 def main():
     st.title("⚡ High-Level NEM Dispatch Analysis")
     st.markdown("Interactive visualisation of PyPSA dispatch scenarios at different temporal resolutions.")
@@ -116,8 +324,23 @@ def main():
         help="Select the energy scenario to analyze - this will load the corresponding network data. Scenarios are scaled-up from the *0_2024_baseline* baseline scenario."
     )
     
-    # Get network info for selected scenario
-    network_info = get_network_info(scenarios[scenario_name])
+    # Get network info for selected scenario, kept in session state so reruns
+    # reuse the same dict (and regions tuple) without another cache lookup;
+    # the file's mtime is part of the key, so a rewritten .nc is read again
+    scenario_path = scenarios[scenario_name]
+    info_key = f"network_info:{scenario_path}:{Path(scenario_path).stat().st_mtime}"
+    network_info = st.session_state.get(info_key)
+    if network_info is None:
+        # The first lookup per resolution builds the index, reading every
+        # scenario serially under the NetCDF lock; this is the cache warm-up
+        network_info = get_scenario_index(resolution, scenarios).get(scenario_name)
+        if network_info is None:
+            # Not in the index because its file could not be read: retry it
+            # directly so the error is reported for this scenario only
+            network_info = get_network_info(scenario_path)
+        if network_info:
+            network_info = {**network_info, 'regions': tuple(network_info['regions'])}
+            st.session_state[info_key] = network_info
     
     if not network_info:
         st.error("Failed to load scenario data")
@@ -129,10 +352,7 @@ def main():
     # Display scenario objective if available
     if scenario_objective:
         st.sidebar.header("📋 Scenario Objective")
-        st.sidebar.markdown(
-            scenario_objective.replace("\n", "<br>"),
-            unsafe_allow_html=True
-        )
+        st.sidebar.text(scenario_objective)
     
     # Region selection
     regions = st.sidebar.multiselect(
@@ -142,53 +362,54 @@ def main():
         help="Select one or more regions to include in the analysis"
     )
     
-    # Date selection
-    col1, col2 = st.sidebar.columns(2)
-    with col1:
-        start_date = st.date_input(
-            "Start Date:",
-            value=network_info['start_date'],
-            min_value=network_info['start_date'],
-            max_value=network_info['end_date'],
-            help="Select the start date for analysis"
-        )
-    
-    with col2:
-        # Adjust default days based on resolution
-        default_days = 7
-        max_days = 365
+    # Date, duration and display options are batched in one form, so editing
+    # several of them triggers a single rerun when "Update" is pressed
+    with st.sidebar.form("controls"):
+        # Date selection
+        col1, col2 = st.columns(2)
+        with col1:
+            start_date = st.date_input(
+                "Start Date:",
+                value=network_info['start_date'],
+                min_value=network_info['start_date'],
+                max_value=network_info['end_date'],
+                help="Select the start date for analysis"
+            )
         
-        days = st.number_input(
-            "Days:",
-            min_value=1,
-            max_value=max_days,
-            value=default_days,
-            help=f"Number of days to analyse."
-        )
-    
-    # Options
-    st.sidebar.markdown("### 🔧 Display Options")
-    
-    col1, col2 = st.sidebar.columns(2)
-    with col1:
-        show_imports = st.checkbox(
-            "Imports/Exports",
-            value=True,
-            help="Show import/export flows"
-        )
-    
-    with col2:
-        show_curtailment = st.checkbox(
-            "Curtailment",
-            value=True,
-            help="Show renewable curtailment (wind, utility-scale solar & rooftop solar)"
-        )
-    
-    # Get the objective from the loaded CSV data
-    csv_scenario_name = scenario_name
-    scenario_objective_from_csv = scenario_objectives.get(csv_scenario_name, "")
+        with col2:
+            # Adjust default days based on resolution
+            default_days = 7
+            max_days = 365
+            
+            days = st.number_input(
+                "Days:",
+                min_value=1,
+                max_value=max_days,
+                value=default_days,
+                help=f"Number of days to analyse."
+            )
+        
+        # Options
+        st.markdown("### 🔧 Display Options")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            show_imports = st.checkbox(
+                "Imports/Exports",
+                value=True,
+                help="Show import/export flows"
+            )
+        
+        with col2:
+            show_curtailment = st.checkbox(
+                "Curtailment",
+                value=True,
+                help="Show renewable curtailment (wind, utility-scale solar & rooftop solar)"
+            )
+            
+        st.form_submit_button("Update")
     
-    # Auto-generate plot when inputs change
+    # Generate the plot from the submitted inputs (unchanged reruns reuse the last figure)
     if regions:
         generate_plot(
             scenario_name=scenario_name,
@@ -198,7 +419,7 @@ def main():
             regions=regions,
             show_imports=show_imports,
             show_curtailment=show_curtailment,
-            scenario_objective=scenario_objective_from_csv,
+            scenario_objective=scenario_objective,
             resolution=resolution
         )
     
@@ -220,24 +441,28 @@ def main():
 def generate_plot(scenario_name, scenario_path, start_date, days, regions, show_imports, show_curtailment, scenario_objective="", resolution="30mins"):
     """Generate and display the dispatch plot"""
     
+    # Reruns that leave the plot inputs unchanged (e.g. opening the info
+    # expander) re-display the last figure of this session as is
+    sig = (scenario_path, start_date, days, tuple(regions), show_imports, show_curtailment, resolution)
+    if st.session_state.get("last_sig") == sig and "last_fig" in st.session_state:
+        st.plotly_chart(st.session_state["last_fig"], use_container_width=True)
+        return
+    
     try:
         with st.spinner("🔄 Updating plot..."):
-            n = load_network(scenario_path)
-            
             # Convert date to string format
             start_date_str = start_date.strftime("%Y-%m-%d")
             
-            # Generate plot with scenario_objective
-            fig = plot_dispatch(
-                n,
-                time=start_date_str,
-                days=days,
-                regions=regions,
-                show_imports=show_imports,
-                show_curtailment=show_curtailment,
-                scenario_name=scenario_name,
-                scenario_objective=scenario_objective,
-                interactive=True,
+            # Generate plot with scenario_objective (cached on all plot inputs)
+            fig = build_fig(
+                scenario_path,
+                start_date_str,
+                days,
+                tuple(sorted(regions)),
+                show_imports,
+                show_curtailment,
+                scenario_name,
+                scenario_objective,
             )
             
             # Enhance the plot title
@@ -253,6 +478,8 @@ def generate_plot(scenario_name, scenario_path, start_date, days, regions, show_
                 title=f"Dispatch Analysis<br><sub>{' | '.join(title_parts)}</sub>",
                 height=700
             )
+            st.session_state["last_sig"] = sig
+            st.session_state["last_fig"] = fig
         
         # Display the plot
         st.plotly_chart(fig, use_container_width=True)